@@ -4,25 +4,43 @@ FastAPI service for merging model and product images
 """
 
 from fastapi import FastAPI, File, UploadFile, HTTPException, Form, Body
-from fastapi.responses import JSONResponse, FileResponse
+from fastapi.responses import ORJSONResponse, Response
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
-from PIL import Image
+from starlette.concurrency import run_in_threadpool
+from PIL import Image, features
+import PIL
+import anyio
+import asyncio
 import os
+import logging
 import base64
 import io
-import uuid
-import requests
+import math
+import heapq
+import time
+import secrets
+import aiohttp
+import orjson
 from datetime import datetime
 from pathlib import Path
-import shutil
 from pydantic import BaseModel
 from typing import Optional
+from collections import OrderedDict
+import numpy as np
+
+try:
+    import cv2
+except ImportError:  # OpenCV backend is optional
+    cv2 = None
+
+logger = logging.getLogger("uvicorn.error")
 
 app = FastAPI(
     title="Image Merger API",
     description="Merge model and product images side by side",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=ORJSONResponse
 )
 
 # Enable CORS
@@ -34,22 +52,200 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Create directories for uploads and outputs
-UPLOAD_DIR = Path("uploads")
+# Create directory for outputs
 OUTPUT_DIR = Path("outputs")
-UPLOAD_DIR.mkdir(exist_ok=True)
 OUTPUT_DIR.mkdir(exist_ok=True)
 
-# Mount static files to serve merged images
+# JPEG model images are decoded at the smallest 1/2, 1/4 or 1/8 scale that
+# keeps at least this multiple of the target height for the LANCZOS pass;
+# 1 lets libjpeg's IDCT scaling do all of the integer part of the downscale
+DRAFT_OVERSAMPLE = 1
+
+# Large downscales first shrink by an integer box reduce() so LANCZOS only
+# covers the last (at most) 3x; per Pillow's docs this is visually lossless
+RESIZE_REDUCING_GAP = 3.0
+
+# Decoded URL images are kept in memory up to this many pixel bytes
+IMAGE_CACHE_MAX_BYTES = 512 * 1024 * 1024
+# Cached URL images are revalidated with a conditional GET when the origin sent
+# an ETag or Last-Modified; otherwise they are trusted for this many seconds
+IMAGE_CACHE_TTL = 300
+
+# Merged outputs older than this are removed by the background sweeper
+OUTPUT_MAX_AGE_HOURS = 24
+CLEANUP_INTERVAL = 60
+
+# Mount static files to serve merged images (GET /outputs/{filename})
 app.mount("/outputs", StaticFiles(directory="outputs"), name="outputs")
 
 
+@app.on_event("startup")
+async def log_imaging_backend():
+    """Log the loaded Pillow build (Pillow-SIMD versions carry a .postN suffix)"""
+    logger.info(
+        "Pillow %s loaded (libjpeg-turbo: %s)",
+        PIL.__version__,
+        features.check_feature("libjpeg_turbo")
+    )
+
+
+@app.on_event("startup")
+async def configure_threadpool():
+    """Size the worker pool used for blocking image work (PIL releases the GIL)"""
+    limiter = anyio.to_thread.current_default_thread_limiter()
+    limiter.total_tokens = (os.cpu_count() or 1) * 2
+
+
+class ImageCache:
+    """
+    LRU cache of decoded images, bounded by total pixel bytes
+    Each entry keeps the conditional-request headers (If-None-Match /
+    If-Modified-Since) built from the origin's validators; entries without
+    validators expire after ttl seconds
+    """
+
+    def __init__(self, max_bytes: int, ttl: float):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.total_bytes = 0
+        self.entries: "OrderedDict[tuple, tuple]" = OrderedDict()
+
+    @staticmethod
+    def _nbytes(image: Image.Image) -> int:
+        # Pillow stores multi-band pixels (RGB included) and I/F in 4 bytes
+        bytes_per_pixel = 4 if len(image.getbands()) > 1 or image.mode in ('I', 'F') else 1
+        return image.width * image.height * bytes_per_pixel
+
+    def _remove(self, key: tuple):
+        image, _, _ = self.entries.pop(key)
+        self.total_bytes -= self._nbytes(image)
+
+    def get(self, key: tuple) -> Optional[tuple]:
+        """
+        Return (image, conditional_headers) or None; the image is shared with
+        the cache, so callers must not modify it in place
+        """
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        image, conditional_headers, stored_at = entry
+        if not conditional_headers and time.time() - stored_at > self.ttl:
+            self._remove(key)
+            return None
+        self.entries.move_to_end(key)
+        return image, conditional_headers
+
+    def put(self, key: tuple, image: Image.Image, conditional_headers: dict):
+        size = self._nbytes(image)
+        if size > self.max_bytes:
+            return
+        if key in self.entries:
+            self._remove(key)
+        self.entries[key] = (image, conditional_headers, time.time())
+        self.total_bytes += size
+        while self.total_bytes > self.max_bytes:
+            self._remove(next(iter(self.entries)))
+
+
+url_image_cache = ImageCache(IMAGE_CACHE_MAX_BYTES, IMAGE_CACHE_TTL)
+
+
+class OutputExpiry:
+    """
+    Min-heap of (created_at, path) for merged outputs, so cleanup only
+    touches files that have actually expired
+    """
+
+    def __init__(self):
+        self.heap = []
+
+    def track(self, path: Path, created_at: Optional[float] = None):
+        heapq.heappush(self.heap, (created_at or time.time(), path))
+
+    def seed(self, directory: Path):
+        """Track files left over from a previous run (one scan at startup)"""
+        for file_path in directory.iterdir():
+            if file_path.is_file():
+                self.track(file_path, file_path.stat().st_mtime)
+
+    def expire(self, max_age_seconds: float) -> int:
+        """Remove tracked files older than max_age_seconds"""
+        cutoff = time.time() - max_age_seconds
+        removed = 0
+        while self.heap and self.heap[0][0] < cutoff:
+            _, path = heapq.heappop(self.heap)
+            path.unlink(missing_ok=True)
+            removed += 1
+        return removed
+
+    @staticmethod
+    def expire_directory(directory: Path, max_age_seconds: float) -> int:
+        """
+        Remove files older than max_age_seconds by scanning the directory;
+        unlike expire() this also covers outputs tracked by other workers
+        """
+        cutoff = time.time() - max_age_seconds
+        removed = 0
+        for file_path in directory.iterdir():
+            if file_path.is_file() and file_path.stat().st_mtime < cutoff:
+                file_path.unlink(missing_ok=True)
+                removed += 1
+        return removed
+
+
+output_expiry = OutputExpiry()
+cleanup_task: Optional[asyncio.Task] = None
+
+
+async def sweep_expired_outputs():
+    while True:
+        await asyncio.sleep(CLEANUP_INTERVAL)
+        try:
+            output_expiry.expire(OUTPUT_MAX_AGE_HOURS * 3600)
+        except OSError as e:
+            logger.warning("Output cleanup failed: %s", e)
+
+
+@app.on_event("startup")
+async def start_output_sweeper():
+    global cleanup_task
+    output_expiry.seed(OUTPUT_DIR)
+    cleanup_task = asyncio.create_task(sweep_expired_outputs())
+
+
+@app.on_event("shutdown")
+async def stop_output_sweeper():
+    if cleanup_task is not None:
+        cleanup_task.cancel()
+
+
+# Shared HTTP client for downloading source images (connection pooling, keep-alive)
+http_session: Optional[aiohttp.ClientSession] = None
+
+
+@app.on_event("startup")
+async def open_http_session():
+    global http_session
+    http_session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=30))
+
+
+@app.on_event("shutdown")
+async def close_http_session():
+    if http_session is not None:
+        await http_session.close()
+
+
 # Pydantic models for JSON requests
 class ImageMergeRequest(BaseModel):
     model_image: str  # Image URL or base64 encoded image
     product_image: str  # Image URL or base64 encoded image
     target_height: Optional[int] = 1200
     output_format: Optional[str] = "jpg"
+    quality: Optional[int] = 92
+    png_compress_level: Optional[int] = 4
+    backend: Optional[str] = "pillow"
+    optimize: Optional[bool] = False
+    progressive: Optional[bool] = False
     
     class Config:
         json_schema_extra = {
@@ -57,81 +253,159 @@ class ImageMergeRequest(BaseModel):
                 "model_image": "https://example.com/model.jpg",
                 "product_image": "https://example.com/product.png",
                 "target_height": 1200,
-                "output_format": "jpg"
+                "output_format": "jpg",
+                "quality": 92,
+                "png_compress_level": 4,
+                "backend": "pillow",
+                "optimize": False,
+                "progressive": False
             }
         }
 
 
-def merge_images_func(model_img_path: str, product_img_path: str, 
-                      output_path: str, target_height: int = 1200):
+# Encoders by output format (JPEG keeps full 4:4:4 chroma; optimized Huffman
+# tables and progressive scans each cost an extra encode pass, so are opt-in)
+SAVE_FNS = {
+    'jpg': lambda img, path, quality, optimize, progressive, **_: img.save(
+        path, 'JPEG', quality=quality, subsampling=0,
+        optimize=optimize, progressive=progressive
+    ),
+    'png': lambda img, path, png_compress_level, **_: img.save(
+        path, 'PNG', compress_level=png_compress_level
+    ),
+}
+SAVE_FNS['jpeg'] = SAVE_FNS['jpg']
+
+
+def flatten_to_rgb(img: Image.Image) -> Image.Image:
+    """
+    Convert an image to RGB, compositing any transparency onto white
+    """
+    if img.mode in ('RGBA', 'LA'):
+        alpha = img.getchannel('A')
+        if alpha.getextrema() == (255, 255):
+            # Fully opaque: a plain conversion is enough, skip the alpha composite
+            return img.convert('RGB')
+        # Create white background for transparent images
+        background = Image.new('RGB', img.size, (255, 255, 255))
+        if img.mode == 'RGBA':
+            background.paste(img, mask=alpha)
+        else:
+            background.paste(img)
+        return background
+    if img.mode != 'RGB':
+        return img.convert('RGB')
+    return img
+
+
+def compose_side_by_side(left: np.ndarray, right: np.ndarray, height: int) -> np.ndarray:
     """
-    Merge two images side by side with maximum quality
+    Place two RGB arrays side by side, centered vertically on a white canvas.
+    Only the strips above and below each image are filled with white.
+    Used by the OpenCV backend, whose resized model is already an ndarray.
+    """
+    left_width = left.shape[1]
+    canvas = np.empty((height, left_width + right.shape[1], 3), np.uint8)
+    for arr, x0, x1 in ((left, 0, left_width), (right, left_width, canvas.shape[1])):
+        y0 = (height - arr.shape[0]) // 2
+        y1 = y0 + arr.shape[0]
+        canvas[:y0, x0:x1] = 255
+        canvas[y0:y1, x0:x1] = arr
+        canvas[y1:, x0:x1] = 255
+    return canvas
+
+
+def paste_side_by_side(left: Image.Image, right: Image.Image, height: int) -> Image.Image:
+    """
+    Pillow counterpart of compose_side_by_side(): paste into an uninitialised
+    canvas and fill only the strips above and below each image with white
+    """
+    canvas = Image.new('RGB', (left.width + right.width, height), None)
+    for img, x0 in ((left, 0), (right, left.width)):
+        y0 = (height - img.height) // 2
+        y1 = y0 + img.height
+        canvas.paste(img, (x0, y0))
+        if y0 > 0:
+            canvas.paste((255, 255, 255), (x0, 0, x0 + img.width, y0))
+        if y1 < height:
+            canvas.paste((255, 255, 255), (x0, y1, x0 + img.width, height))
+    return canvas
+
+
+def merge_with_opencv(model_img: Image.Image, product_img: Image.Image,
+                      output_path: str, model_new_width: int, target_height: int,
+                      final_height: int, output_format: str, quality: int,
+                      png_compress_level: int, optimize: bool, progressive: bool):
+    """
+    Resize, compose and encode with OpenCV's SIMD kernels (RGB images only)
+    """
+    model_arr = cv2.resize(
+        np.asarray(model_img),
+        (model_new_width, target_height),
+        interpolation=cv2.INTER_LANCZOS4
+    )
+    canvas = compose_side_by_side(model_arr, np.asarray(product_img), final_height)
+    
+    if output_format == 'png':
+        params = [cv2.IMWRITE_PNG_COMPRESSION, png_compress_level]
+    else:
+        params = [
+            cv2.IMWRITE_JPEG_QUALITY, quality,
+            cv2.IMWRITE_JPEG_SAMPLING_FACTOR, cv2.IMWRITE_JPEG_SAMPLING_FACTOR_444,
+            cv2.IMWRITE_JPEG_OPTIMIZE, int(optimize),
+            cv2.IMWRITE_JPEG_PROGRESSIVE, int(progressive)
+        ]
+    # OpenCV encoders expect BGR channel order
+    ok, encoded = cv2.imencode(f".{output_format}", cv2.cvtColor(canvas, cv2.COLOR_RGB2BGR), params)
+    if not ok:
+        raise ValueError(f"OpenCV could not encode .{output_format} output")
+    with open(output_path, "wb") as f:
+        f.write(encoded.tobytes())
+
+
+def merge_images_func(model_img: Image.Image, product_img: Image.Image, 
+                      output_path: str, target_height: int = 1200,
+                      output_format: str = "jpg", quality: int = 92,
+                      png_compress_level: int = 4, backend: str = "pillow",
+                      optimize: bool = False, progressive: bool = False):
+    """
+    Merge two already-decoded images side by side and save the result
     """
     try:
-        # Load images
-        model_img = Image.open(model_img_path)
-        product_img = Image.open(product_img_path)
-        
         # Handle transparent backgrounds properly
-        if model_img.mode in ('RGBA', 'LA'):
-            # Create white background for transparent images
-            background = Image.new('RGB', model_img.size, (255, 255, 255))
-            if model_img.mode == 'RGBA':
-                background.paste(model_img, mask=model_img.split()[-1])
-            else:
-                background.paste(model_img)
-            model_img = background
-        elif model_img.mode != 'RGB':
-            model_img = model_img.convert('RGB')
-            
-        if product_img.mode in ('RGBA', 'LA'):
-            # Create white background for transparent images
-            background = Image.new('RGB', product_img.size, (255, 255, 255))
-            if product_img.mode == 'RGBA':
-                background.paste(product_img, mask=product_img.split()[-1])
-            else:
-                background.paste(product_img)
-            product_img = background
-        elif product_img.mode != 'RGB':
-            product_img = product_img.convert('RGB')
+        model_img = flatten_to_rgb(model_img)
+        product_img = flatten_to_rgb(product_img)
         
         # Resize model image to target height, keep product at original size
         model_aspect = model_img.width / model_img.height
         model_new_width = int(target_height * model_aspect)
         
-        model_img_resized = model_img.resize(
-            (model_new_width, target_height), 
-            Image.Resampling.LANCZOS
-        )
-        
-        # Keep product image at its original size
-        product_img_resized = product_img
-        product_width = product_img.width
-        product_height = product_img.height
-        
         # Use the maximum height between model and product
-        final_height = max(target_height, product_height)
+        final_height = max(target_height, product_img.height)
+        total_width = model_new_width + product_img.width
         
-        # Create merged image with enough space for both
-        total_width = model_new_width + product_width
-        merged_img = Image.new('RGB', (total_width, final_height), (255, 255, 255))
+        if backend == "opencv":
+            merge_with_opencv(
+                model_img, product_img, output_path, model_new_width,
+                target_height, final_height, output_format, quality,
+                png_compress_level, optimize, progressive
+            )
+            return True, total_width, final_height
         
-        # Paste model image on the left (centered vertically if needed)
-        model_y_offset = (final_height - target_height) // 2
-        merged_img.paste(model_img_resized, (0, model_y_offset))
+        model_img_resized = model_img.resize(
+            (model_new_width, target_height), 
+            Image.Resampling.LANCZOS,
+            reducing_gap=RESIZE_REDUCING_GAP
+        )
         
-        # Paste product image on the right (centered vertically if needed)
-        product_y_offset = (final_height - product_height) // 2
-        merged_img.paste(product_img_resized, (model_new_width, product_y_offset))
+        # Model on the left, product at its original size on the right
+        merged_img = paste_side_by_side(model_img_resized, product_img, final_height)
         
-        # Save with maximum quality
-        file_ext = output_path.lower().split('.')[-1]
-        if file_ext in ['jpg', 'jpeg']:
-            merged_img.save(output_path, quality=100, optimize=True, subsampling=0)
-        elif file_ext == 'png':
-            merged_img.save(output_path, optimize=True, compress_level=9)
-        else:
-            merged_img.save(output_path, quality=100)
+        SAVE_FNS[output_format](
+            merged_img, output_path,
+            quality=quality, png_compress_level=png_compress_level,
+            optimize=optimize, progressive=progressive
+        )
         
         return True, total_width, final_height
     
@@ -139,54 +413,91 @@ def merge_images_func(model_img_path: str, product_img_path: str,
         return False, 0, 0, str(e)
 
 
-def load_image_from_source(image_source: str) -> Image.Image:
+def open_image(fp, target_height: Optional[int] = None) -> Image.Image:
+    """
+    Open and fully decode an image from a path or file object
+    When target_height is given, JPEGs are decoded at a reduced scale
+    """
+    image = Image.open(fp)
+    draft_height = target_height * DRAFT_OVERSAMPLE if target_height else None
+    if draft_height and image.height > draft_height:
+        # libjpeg scales during IDCT; draft is a no-op for other formats
+        draft_width = math.ceil(image.width * draft_height / image.height)
+        image.draft('RGB', (draft_width, draft_height))
+    image.load()
+    return image
+
+
+async def load_image_from_source(image_source: str,
+                                 target_height: Optional[int] = None) -> Image.Image:
     """
     Load image from URL or base64 string
     Supports both URLs and base64 encoded images
+    target_height lets JPEGs decode at a reduced scale (see open_image)
     """
     try:
         # Check if it's a URL
         if image_source.startswith(('http://', 'https://')):
-            # Download image from URL
-            response = requests.get(image_source, timeout=30)
-            response.raise_for_status()
-            image_data = response.content
-            image = Image.open(io.BytesIO(image_data))
+            cache_key = (image_source, target_height)
+            cached = url_image_cache.get(cache_key)
+            request_headers = {}
+            if cached is not None:
+                cached_image, request_headers = cached
+                if not request_headers:
+                    # No validators from the origin: trusted until the TTL
+                    return cached_image
+            # Download (or revalidate) the image without blocking the event loop
+            async with http_session.get(image_source, headers=request_headers) as response:
+                if cached is not None and response.status == 304:
+                    return cached_image
+                response.raise_for_status()
+                image_data = await response.read()
+                conditional_headers = {}
+                if 'ETag' in response.headers:
+                    conditional_headers['If-None-Match'] = response.headers['ETag']
+                if 'Last-Modified' in response.headers:
+                    conditional_headers['If-Modified-Since'] = response.headers['Last-Modified']
+            image = await run_in_threadpool(open_image, io.BytesIO(image_data), target_height)
+            url_image_cache.put(cache_key, image, conditional_headers)
+            # Shared with the cache: merge_images_func never mutates its inputs
+            return image
         elif image_source.startswith('data:'):
             # Base64 data URL
             base64_string = image_source.split(',')[1]
             image_data = base64.b64decode(base64_string)
-            image = Image.open(io.BytesIO(image_data))
         else:
             # Raw base64 string
             image_data = base64.b64decode(image_source)
-            image = Image.open(io.BytesIO(image_data))
         
-        return image
-    except requests.exceptions.RequestException as e:
+        return await run_in_threadpool(open_image, io.BytesIO(image_data), target_height)
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
         raise HTTPException(status_code=400, detail=f"Failed to download image from URL: {str(e)}")
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Invalid image data: {str(e)}")
 
 
+# Static root payload, serialized once at import
+ROOT_PAYLOAD = orjson.dumps({
+    "message": "Image Merger API",
+    "version": "1.0.0",
+    "endpoints": {
+        "POST /merge": "Merge two images (multipart/form-data)",
+        "POST /merge-json": "Merge two images (JSON with base64)",
+        "GET /health": "Health check"
+    }
+})
+
+
 @app.get("/")
 async def root():
     """API root endpoint"""
-    return {
-        "message": "Image Merger API",
-        "version": "1.0.0",
-        "endpoints": {
-            "POST /merge": "Merge two images (multipart/form-data)",
-            "POST /merge-json": "Merge two images (JSON with base64)",
-            "GET /health": "Health check"
-        }
-    }
+    return Response(content=ROOT_PAYLOAD, media_type="application/json")
 
 
 @app.get("/health")
 async def health_check():
     """Health check endpoint"""
-    return {"status": "healthy", "timestamp": datetime.utcnow().isoformat()}
+    return ORJSONResponse({"status": "healthy", "timestamp": datetime.utcnow()})
 
 
 @app.post("/merge")
@@ -194,7 +505,12 @@ async def merge_images_endpoint(
     model_image: UploadFile = File(..., description="Model/Person image"),
     product_image: UploadFile = File(..., description="Product image"),
     target_height: int = Form(1200, description="Target height in pixels"),
-    output_format: str = Form("jpg", description="Output format: jpg or png")
+    output_format: str = Form("jpg", description="Output format: jpg or png"),
+    quality: int = Form(92, description="JPEG quality (1-100)"),
+    png_compress_level: int = Form(4, description="PNG zlib compression level (1-9)"),
+    backend: str = Form("pillow", description="Imaging backend: pillow or opencv"),
+    optimize: bool = Form(False, description="JPEG: optimized Huffman tables (a few % smaller, extra encode pass)"),
+    progressive: bool = Form(False, description="JPEG: progressive scans (slower encode)")
 ):
     """
     Merge two images side by side
@@ -203,6 +519,11 @@ async def merge_images_endpoint(
     - **product_image**: The product image (right side)
     - **target_height**: Target height in pixels (default: 1200)
     - **output_format**: Output format - jpg or png (default: jpg)
+    - **quality**: JPEG quality 1-100 (default: 92)
+    - **png_compress_level**: PNG compression level 1-9 (default: 4)
+    - **backend**: Imaging backend - pillow or opencv (default: pillow)
+    - **optimize**: JPEG optimized Huffman tables, ~3-5% smaller but slower (default: false)
+    - **progressive**: Progressive JPEG, slower to encode (default: false)
     
     Returns a JSON with the URL to the merged image
     """
@@ -215,65 +536,73 @@ async def merge_images_endpoint(
     if target_height < 100 or target_height > 5000:
         raise HTTPException(status_code=400, detail="target_height must be between 100 and 5000")
     
-    # Generate unique filenames
-    unique_id = str(uuid.uuid4())
+    # Validate JPEG quality
+    if quality < 1 or quality > 100:
+        raise HTTPException(status_code=400, detail="quality must be between 1 and 100")
+    
+    # Validate PNG compression level
+    if png_compress_level < 1 or png_compress_level > 9:
+        raise HTTPException(status_code=400, detail="png_compress_level must be between 1 and 9")
     
+    # Validate imaging backend
+    if backend not in ['pillow', 'opencv']:
+        raise HTTPException(status_code=400, detail="backend must be 'pillow' or 'opencv'")
+    if backend == 'opencv' and cv2 is None:
+        raise HTTPException(status_code=400, detail="opencv backend is not installed on this server")
+    
+    # Decode uploads straight from the spooled request files (no disk round-trip)
     try:
-        # Save uploaded files temporarily
-        model_temp_path = UPLOAD_DIR / f"{unique_id}_model_{model_image.filename}"
-        product_temp_path = UPLOAD_DIR / f"{unique_id}_product_{product_image.filename}"
-        
-        with open(model_temp_path, "wb") as buffer:
-            shutil.copyfileobj(model_image.file, buffer)
-        
-        with open(product_temp_path, "wb") as buffer:
-            shutil.copyfileobj(product_image.file, buffer)
-        
-        # Generate output filename
-        output_filename = f"merged_{unique_id}.{output_format}"
-        output_path = OUTPUT_DIR / output_filename
-        
-        # Merge images
-        result = merge_images_func(
-            str(model_temp_path),
-            str(product_temp_path),
+        model_img = await run_in_threadpool(open_image, model_image.file, target_height)
+        product_img = await run_in_threadpool(open_image, product_image.file)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Invalid image data: {str(e)}")
+    
+    # Generate unique filename
+    unique_id = secrets.token_hex(8)
+    output_filename = f"merged_{unique_id}.{output_format}"
+    output_path = OUTPUT_DIR / output_filename
+    
+    # Track the output before merging, so it still expires if the client
+    # disconnects while the merge is running
+    output_expiry.track(output_path)
+    try:
+        # Merge images off the event loop
+        result = await run_in_threadpool(
+            merge_images_func,
+            model_img,
+            product_img,
             str(output_path),
-            target_height
+            target_height,
+            output_format,
+            quality,
+            png_compress_level,
+            backend,
+            optimize,
+            progressive
         )
-        
-        # Clean up temporary files
-        model_temp_path.unlink(missing_ok=True)
-        product_temp_path.unlink(missing_ok=True)
-        
-        if result[0]:
-            # Get the base URL - use Railway URL for production
-            base_url = "https://image-merger-api-production.up.railway.app"
-            
-            return JSONResponse({
-                "success": True,
-                "message": "Images merged successfully",
-                "output": {
-                    "url": f"{base_url}/outputs/{output_filename}",
-                    "filename": output_filename,
-                    "dimensions": {
-                        "width": result[1],
-                        "height": result[2]
-                    },
-                    "format": output_format.upper()
-                },
-                "timestamp": datetime.utcnow().isoformat()
-            })
-        else:
-            raise HTTPException(status_code=500, detail=f"Failed to merge images: {result[3]}")
-    
     except Exception as e:
-        # Clean up on error
-        if 'model_temp_path' in locals():
-            Path(model_temp_path).unlink(missing_ok=True)
-        if 'product_temp_path' in locals():
-            Path(product_temp_path).unlink(missing_ok=True)
-        
         raise HTTPException(status_code=500, detail=f"Error processing images: {str(e)}")
+    
+    if not result[0]:
+        raise HTTPException(status_code=500, detail=f"Failed to merge images: {result[3]}")
+    
+    # Get the base URL - use Railway URL for production
+    base_url = "https://image-merger-api-production.up.railway.app"
+    
+    return ORJSONResponse({
+        "success": True,
+        "message": "Images merged successfully",
+        "output": {
+            "url": f"{base_url}/outputs/{output_filename}",
+            "filename": output_filename,
+            "dimensions": {
+                "width": result[1],
+                "height": result[2]
+            },
+            "format": output_format.upper()
+        },
+        "timestamp": datetime.utcnow()
+    })
 
 
 @app.post("/merge-json")
@@ -285,6 +614,11 @@ async def merge_images_json(request: ImageMergeRequest):
     - **product_image**: Image URL or base64 encoded product image (right side)  
     - **target_height**: Target height in pixels (default: 1200)
     - **output_format**: Output format - jpg or png (default: jpg)
+    - **quality**: JPEG quality 1-100 (default: 92)
+    - **png_compress_level**: PNG compression level 1-9 (default: 4)
+    - **backend**: Imaging backend - pillow or opencv (default: pillow)
+    - **optimize**: JPEG optimized Huffman tables, ~3-5% smaller but slower (default: false)
+    - **progressive**: Progressive JPEG, slower to encode (default: false)
     
     Returns a JSON with the URL to the merged image
     """
@@ -297,92 +631,68 @@ async def merge_images_json(request: ImageMergeRequest):
     if request.target_height < 100 or request.target_height > 5000:
         raise HTTPException(status_code=400, detail="target_height must be between 100 and 5000")
     
+    # Validate JPEG quality
+    if request.quality < 1 or request.quality > 100:
+        raise HTTPException(status_code=400, detail="quality must be between 1 and 100")
+    
+    # Validate PNG compression level
+    if request.png_compress_level < 1 or request.png_compress_level > 9:
+        raise HTTPException(status_code=400, detail="png_compress_level must be between 1 and 9")
+    
+    # Validate imaging backend
+    if request.backend not in ['pillow', 'opencv']:
+        raise HTTPException(status_code=400, detail="backend must be 'pillow' or 'opencv'")
+    if request.backend == 'opencv' and cv2 is None:
+        raise HTTPException(status_code=400, detail="opencv backend is not installed on this server")
+    
     # Generate unique filename
-    unique_id = str(uuid.uuid4())
+    unique_id = secrets.token_hex(8)
     output_filename = f"merged_{unique_id}.{request.output_format}"
     output_path = OUTPUT_DIR / output_filename
     
     try:
         # Load images from URLs or base64
-        model_img = load_image_from_source(request.model_image)
-        product_img = load_image_from_source(request.product_image)
-        
-        # Handle transparent backgrounds properly
-        if model_img.mode in ('RGBA', 'LA'):
-            # Create white background for transparent images
-            background = Image.new('RGB', model_img.size, (255, 255, 255))
-            if model_img.mode == 'RGBA':
-                background.paste(model_img, mask=model_img.split()[-1])
-            else:
-                background.paste(model_img)
-            model_img = background
-        elif model_img.mode != 'RGB':
-            model_img = model_img.convert('RGB')
-            
-        if product_img.mode in ('RGBA', 'LA'):
-            # Create white background for transparent images
-            background = Image.new('RGB', product_img.size, (255, 255, 255))
-            if product_img.mode == 'RGBA':
-                background.paste(product_img, mask=product_img.split()[-1])
-            else:
-                background.paste(product_img)
-            product_img = background
-        elif product_img.mode != 'RGB':
-            product_img = product_img.convert('RGB')
-        
-        # Resize model image to target height, keep product at original size
-        model_aspect = model_img.width / model_img.height
-        model_new_width = int(request.target_height * model_aspect)
-        
-        model_img_resized = model_img.resize(
-            (model_new_width, request.target_height), 
-            Image.Resampling.LANCZOS
+        model_img, product_img = await asyncio.gather(
+            load_image_from_source(request.model_image, request.target_height),
+            load_image_from_source(request.product_image)
         )
         
-        # Keep product image at its original size
-        product_img_resized = product_img
-        product_width = product_img.width
-        product_height = product_img.height
-        
-        # Use the maximum height between model and product
-        final_height = max(request.target_height, product_height)
-        
-        # Create merged image with enough space for both
-        total_width = model_new_width + product_width
-        merged_img = Image.new('RGB', (total_width, final_height), (255, 255, 255))
-        
-        # Paste model image on the left (centered vertically if needed)
-        model_y_offset = (final_height - request.target_height) // 2
-        merged_img.paste(model_img_resized, (0, model_y_offset))
-        
-        # Paste product image on the right (centered vertically if needed)
-        product_y_offset = (final_height - product_height) // 2
-        merged_img.paste(product_img_resized, (model_new_width, product_y_offset))
-        
-        # Save with maximum quality
-        if request.output_format in ['jpg', 'jpeg']:
-            merged_img.save(str(output_path), quality=100, optimize=True, subsampling=0)
-        elif request.output_format == 'png':
-            merged_img.save(str(output_path), optimize=True, compress_level=9)
-        else:
-            merged_img.save(str(output_path), quality=100)
+        # Track the output before merging, so it still expires if the client
+        # disconnects while the merge is running
+        output_expiry.track(output_path)
+        # Merge images off the event loop
+        result = await run_in_threadpool(
+            merge_images_func,
+            model_img,
+            product_img,
+            str(output_path),
+            request.target_height,
+            request.output_format,
+            request.quality,
+            request.png_compress_level,
+            request.backend,
+            request.optimize,
+            request.progressive
+        )
+        if not result[0]:
+            raise HTTPException(status_code=500, detail=f"Failed to merge images: {result[3]}")
         
         # Get the base URL - use Railway URL for production, localhost for development
         base_url = "https://image-merger-api-production.up.railway.app"
         
-        return JSONResponse({
+        return ORJSONResponse({
             "success": True,
             "message": "Images merged successfully",
             "output": {
                 "url": f"{base_url}/outputs/{output_filename}",
                 "filename": output_filename,
                 "dimensions": {
-                    "width": total_width,
-                    "height": final_height
+                    "width": result[1],
+                    "height": result[2]
                 },
                 "format": request.output_format.upper()
             },
-            "timestamp": datetime.utcnow().isoformat()
+            "timestamp": datetime.utcnow()
         })
         
     except HTTPException:
@@ -391,48 +701,22 @@ async def merge_images_json(request: ImageMergeRequest):
         raise HTTPException(status_code=500, detail=f"Error processing images: {str(e)}")
 
 
-@app.get("/outputs/{filename}")
-async def get_output_image(filename: str):
-    """Serve merged output images"""
-    file_path = OUTPUT_DIR / filename
-    if not file_path.exists():
-        raise HTTPException(status_code=404, detail="Image not found")
-    return FileResponse(file_path)
-
-
 @app.delete("/cleanup")
-async def cleanup_old_files(max_age_hours: int = 24):
+async def cleanup_old_files(max_age_hours: int = OUTPUT_MAX_AGE_HOURS):
     """
     Clean up old files (for maintenance)
-    Removes files older than max_age_hours
+    Removes files older than max_age_hours; outputs are also swept
+    automatically every minute once they pass OUTPUT_MAX_AGE_HOURS
     """
     try:
-        import time
-        current_time = time.time()
-        max_age_seconds = max_age_hours * 3600
-        
-        cleaned_uploads = 0
-        cleaned_outputs = 0
-        
-        # Clean uploads
-        for file_path in UPLOAD_DIR.iterdir():
-            if file_path.is_file():
-                file_age = current_time - file_path.stat().st_mtime
-                if file_age > max_age_seconds:
-                    file_path.unlink()
-                    cleaned_uploads += 1
-        
-        # Clean outputs
-        for file_path in OUTPUT_DIR.iterdir():
-            if file_path.is_file():
-                file_age = current_time - file_path.stat().st_mtime
-                if file_age > max_age_seconds:
-                    file_path.unlink()
-                    cleaned_outputs += 1
+        # Scan the directory rather than this worker's heap, which only holds
+        # the outputs this process created
+        cleaned_outputs = await run_in_threadpool(
+            OutputExpiry.expire_directory, OUTPUT_DIR, max_age_hours * 3600
+        )
         
         return {
             "success": True,
-            "cleaned_uploads": cleaned_uploads,
             "cleaned_outputs": cleaned_outputs
         }
     
@@ -443,5 +727,16 @@ async def cleanup_old_files(max_age_hours: int = 24):
 if __name__ == "__main__":
     import uvicorn
     port = int(os.environ.get("PORT", 8000))
-    uvicorn.run(app, host="0.0.0.0", port=port, log_level="info")
+    # One process by default: the image cache, threadpool and output heap are
+    # all per process, so extra workers multiply their memory and threads
+    workers = int(os.environ.get("WEB_CONCURRENCY", 1))
+    uvicorn.run(
+        "app:app",
+        host="0.0.0.0",
+        port=port,
+        log_level="info",
+        loop="uvloop",
+        http="httptools",
+        workers=workers
+    )
 
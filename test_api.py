@@ -8,6 +8,8 @@ import sys
 import os
 from pathlib import Path
 
+from test_utils import session, check_health
+
 def test_api(base_url, model_image_path, product_image_path, 
              target_height=1200, output_format="jpg"):
     """
@@ -36,11 +38,11 @@ def test_api(base_url, model_image_path, product_image_path,
     try:
         # Test health endpoint
         print("1️⃣  Testing health endpoint...")
-        health_response = requests.get(f"{base_url}/health")
-        if health_response.status_code == 200:
-            print(f"   ✅ Health check passed: {health_response.json()}")
+        health_status, health_body = check_health(base_url)
+        if health_status == 200:
+            print(f"   ✅ Health check passed: {health_body}")
         else:
-            print(f"   ⚠️  Health check returned: {health_response.status_code}")
+            print(f"   ⚠️  Health check returned: {health_status}")
         
         # Test merge endpoint
         print("\n2️⃣  Testing merge endpoint...")
@@ -56,7 +58,7 @@ def test_api(base_url, model_image_path, product_image_path,
         }
         
         print("   📤 Uploading images...")
-        response = requests.post(f"{base_url}/merge", files=files, data=data)
+        response = session.post(f"{base_url}/merge", files=files, data=data)
         
         if response.status_code == 200:
             result = response.json()
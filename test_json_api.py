@@ -4,16 +4,37 @@ Test script for Image Merger API JSON endpoint
 """
 
 import requests
-import base64
 import sys
 import os
 from pathlib import Path
 
+from test_utils import session, check_health
+
+try:
+    import pybase64 as base64  # SIMD-accelerated drop-in for the stdlib module
+except ImportError:
+    import base64
+
+# Refuse inputs that would bloat into an oversized (+33%) JSON payload
+MAX_IMAGE_BYTES = 20 * 1024 * 1024
+# Multiple of 3, so each chunk encodes without padding and the pieces concatenate
+BASE64_CHUNK_SIZE = 48 * 1024
+
 def image_to_base64(image_path):
     """Convert image file to base64 string"""
+    size = os.path.getsize(image_path)
+    if size > MAX_IMAGE_BYTES:
+        raise ValueError(f"{image_path} is {size} bytes (limit: {MAX_IMAGE_BYTES})")
+    
+    parts = []
     with open(image_path, "rb") as image_file:
-        encoded_string = base64.b64encode(image_file.read()).decode('utf-8')
-        return f"data:image/{image_path.suffix[1:]};base64,{encoded_string}"
+        while True:
+            chunk = image_file.read(BASE64_CHUNK_SIZE)
+            if not chunk:
+                break
+            parts.append(base64.b64encode(chunk).decode('ascii'))
+    encoded_string = ''.join(parts)
+    return f"data:image/{image_path.suffix[1:]};base64,{encoded_string}"
 
 def test_json_api(base_url, model_image_path, product_image_path, 
                   target_height=1200, output_format="jpg"):
@@ -43,11 +64,11 @@ def test_json_api(base_url, model_image_path, product_image_path,
     try:
         # Test health endpoint
         print("1️⃣  Testing health endpoint...")
-        health_response = requests.get(f"{base_url}/health")
-        if health_response.status_code == 200:
-            print(f"   ✅ Health check passed: {health_response.json()}")
+        health_status, health_body = check_health(base_url)
+        if health_status == 200:
+            print(f"   ✅ Health check passed: {health_body}")
         else:
-            print(f"   ⚠️  Health check returned: {health_response.status_code}")
+            print(f"   ⚠️  Health check returned: {health_status}")
         
         # Convert images to base64
         print("\n2️⃣  Converting images to base64...")
@@ -67,7 +88,7 @@ def test_json_api(base_url, model_image_path, product_image_path,
         }
         
         print("   📤 Sending JSON request...")
-        response = requests.post(f"{base_url}/merge-json", json=payload)
+        response = session.post(f"{base_url}/merge-json", json=payload)
         
         if response.status_code == 200:
             result = response.json()
@@ -8,6 +8,8 @@ import sys
 import os
 from pathlib import Path
 
+from test_utils import session, check_health
+
 def test_url_api(base_url, model_image_url, product_image_url, 
                  target_height=1200, output_format="jpg"):
     """
@@ -27,11 +29,11 @@ def test_url_api(base_url, model_image_url, product_image_url,
     try:
         # Test health endpoint
         print("1️⃣  Testing health endpoint...")
-        health_response = requests.get(f"{base_url}/health")
-        if health_response.status_code == 200:
-            print(f"   ✅ Health check passed: {health_response.json()}")
+        health_status, health_body = check_health(base_url)
+        if health_status == 200:
+            print(f"   ✅ Health check passed: {health_body}")
         else:
-            print(f"   ⚠️  Health check returned: {health_response.status_code}")
+            print(f"   ⚠️  Health check returned: {health_status}")
         
         # Test JSON merge endpoint with URLs
         print("\n2️⃣  Testing JSON merge endpoint with URLs...")
@@ -47,7 +49,7 @@ def test_url_api(base_url, model_image_url, product_image_url,
         print(f"   📸 Model URL: {model_image_url}")
         print(f"   📸 Product URL: {product_image_url}")
         
-        response = requests.post(f"{base_url}/merge-json", json=payload)
+        response = session.post(f"{base_url}/merge-json", json=payload)
         
         if response.status_code == 200:
             result = response.json()
@@ -0,0 +1,23 @@
+#!/usr/bin/env python3
+"""
+Shared helpers for the Image Merger API test scripts
+"""
+
+import functools
+import requests
+from requests.adapters import HTTPAdapter
+
+# Reuse keep-alive connections (and TLS sessions) across requests
+session = requests.Session()
+session.mount('http://', HTTPAdapter(pool_connections=4, pool_maxsize=4))
+session.mount('https://', HTTPAdapter(pool_connections=4, pool_maxsize=4))
+
+@functools.lru_cache(maxsize=4)
+def check_health(base_url):
+    """
+    Hit the health endpoint once per base URL and return (status_code, body);
+    later calls in the same process reuse the cached result
+    """
+    health_response = session.get(f"{base_url}/health")
+    body = health_response.json() if health_response.status_code == 200 else None
+    return health_response.status_code, body